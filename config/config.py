@@ -14,8 +14,39 @@ config = {
     'debug': True, # To debug or not to debug?
     'listenIP': '0.0.0.0', # Listen address. Default is 0.0.0.0
     'listenPort': 8092, # Listen port. Default is 8092
+    'httpWorkers': 1, # Number of HTTP worker processes. More than 1 pre-forks workers that share the port with SO_REUSEPORT and serve from a shared-memory snapshot. Workers send on-demand reads to the polling process over a Unix socket.
+    'shmSize': 4194304, # Size in bytes of the shared-memory snapshot used when httpWorkers is more than 1.
+    'configReloadInterval': 5, # How often in seconds to check this file for sensor changes, which are applied without a restart. Set to 0 to disable.
     'logMode': 'stdout', # Log mode. Can be stdout, syslog, or none.
+    'snapshotFile': 'snapshot.json', # Where the last readings are checkpointed on shutdown and reloaded (marked stale) on startup. Set to None to disable.
+    'profiling': { # Opt-in profiling of sweeps and HTTP requests. When enabled a window is opened with SIGUSR1 or a POST to /v1/admin/profile?seconds=<n>. With more than one httpWorkers both open the window in the polling process, which profiles sweeps and signals every worker to profile its requests.
+        'enabled': False, # Enable the profiling hooks?
+        'window': 30, # Default profiling window in seconds.
+        'maxWindow': 300, # Longest profiling window in seconds. Longer requests are cut short.
+        'outDir': '/tmp', # Where .prof files and text summaries are written.
+        'adminIPs': ['127.0.0.1'] # Client addresses allowed to use the admin endpoint.
+    },
+    'bulkRead': True, # Start one simultaneous conversion per 1-Wire bus each sweep instead of one per sensor. Needs kernel 5.9+ w1_therm and falls back to per-sensor conversions when unavailable.
+    'quarantine': { # Sensors that keep failing are skipped and re-probed with exponential backoff. Health is shown in /v1/sensors.
+        'failures': 3, # Consecutive failed reads before a sensor is quarantined.
+        'minBackoff': 5.0, # Seconds before the first re-probe.
+        'maxBackoff': 300.0 # Longest time in seconds between re-probes.
+    },
+    'freshRead': { # Limits for on-demand reads with /v1/thermal/<sensor>?fresh=1. Concurrent requests for one sensor share a single read.
+        'minInterval': 0.75, # Minimum seconds between on-demand reads of one sensor. Requests sooner get the last on-demand reading, or HTTP 429 if that read failed.
+        'maxInFlight': 4 # Most on-demand reads on the bus at once. Requests beyond this get HTTP 429.
+    },
     'sensorMode': 'worker', # Sensor mode specifies where we get sensor data from. Valid modes are 'dummy' and 'worker'. This is mostly for development and testing on devices that don't have 1-Wire sensors connected. 
+    'simulation': { # Settings for the simulated sensors used in 'dummy' mode.
+        'seed': 395803958, # The same seed and sensors always produce the same readings.
+        'sensors': 0, # Number of extra virtual sensors to register on top of the configured ones.
+        'timeStep': None, # Simulated seconds per sweep. None runs in real time, 60 runs a simulated day in about 18 minutes.
+        'startHour': 0.0, # Simulated hour of day (UTC) at the first sweep.
+        'crcRate': 0.001, # Per-reading probability of a CRC error.
+        'dropoutRate': 0.0001, # Per-reading probability of a sensor dropping off the bus for a while.
+        'resetRate': 0.0005, # Per-reading probability of an 85 C power-on reset reading.
+        'sensorMeta': ds18b20Meta # Metadata for virtual sensors.
+    },
     'sensors': {
         #'1-Wire sensor ID': {'loc': '<General location>', 'locDetail': '<location detail>', 'sensorMeta': ds18b20Meta}
         # Example DS18B20 with address 28-000006de8409: '28-000006de8409': {'loc': 'outside', 'locDetail': 'west face', 'sensorMeta': ds18b20Meta}
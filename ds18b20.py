@@ -11,16 +11,34 @@ import subprocess
 
 class ds18b20:
 
-    def __init__(self):
+    def __init__(self, logger=None):
         """
         Class for the DS18B20 temperature sensor module, based on caode from Adafruit Industries:
         https://learn.adafruit.com/adafruits-raspberry-pi-lesson-11-ds18b20-temperature-sensing/software
+        Accepts an optional sensLog instance for reporting bulk conversion problems.
         """
+        # Optional logger.
+        self.__logger = logger
+        
         # Minimum time we can wait before polling again is 0.750 seconds.
         self.minPoll = 0.750
         
         # Configuration for the /sys nodes
         self.__baseDir = '/sys/bus/w1/devices/'
+        
+        # Start one simultaneous conversion per bus master each sweep instead of one per sensor read?
+        self.bulkRead = True
+        
+        # Set to False once we find the kernel can't do bulk conversions.
+        self.bulkSupported = None
+        
+        # After a failed bulk trigger, convert per sensor for this many sweeps before trying again.
+        self.__bulkRetrySweeps = 100
+        self.__bulkSkipSweeps = 0
+        
+        # How often to check whether a bulk conversion is done, and how long to wait for it in seconds.
+        self.__bulkPoll = 0.050
+        self.__bulkTimeout = 1.500
 
    
     def __readTempRaw(self, address):
@@ -43,6 +61,76 @@ class ds18b20:
         
         return lines
  
+    def startSweep(self, addresses):
+        """
+        Called before reading each sensor in addresses during a sweep. If bulk reads are on, this starts a simultaneous conversion on every bus master through the w1_therm therm_bulk_read node and waits for it to finish so each read just fetches the scratchpad. Otherwise, or if the bus doesn't support it, each read does its own conversion.
+        """
+        
+        # Nothing to do if we're converting per sensor.
+        if (not self.bulkRead) or (self.bulkSupported == False) or (addresses == []):
+            return
+        
+        # Still backing off after a failed trigger?
+        if self.__bulkSkipSweeps > 0:
+            self.__bulkSkipSweeps -= 1
+            return
+        
+        # Bulk reads need kernel 5.9 or newer. Buses without the node just convert per sensor.
+        bulkNodes = glob.glob(self.__baseDir + 'w1_bus_master*/therm_bulk_read')
+        
+        if bulkNodes == []:
+            self.bulkSupported = False
+            return
+        
+        # Start converting on every bus at once.
+        triggered = []
+        
+        for bulkNode in bulkNodes:
+            try:
+                with open(bulkNode, 'w') as bulkFile:
+                    bulkFile.write('trigger\n')
+                
+                triggered.append(bulkNode)
+            
+            except (IOError, OSError) as e:
+                # Usually a permissions problem or a bus master going away. Sensors on this bus convert per sensor.
+                self.__log("Bulk conversion trigger on %s failed: %s" %(bulkNode, e))
+        
+        if triggered == []:
+            # Fall back to per-sensor conversions for a while, then try again.
+            self.__bulkSkipSweeps = self.__bulkRetrySweeps
+            return
+        
+        self.bulkSupported = True
+        
+        # Wait for the conversions to finish. The node reads -1 while any sensor on the bus is still converting.
+        deadline = time.time() + self.__bulkTimeout
+        
+        for bulkNode in triggered:
+            try:
+                while True:
+                    with open(bulkNode, 'r') as bulkFile:
+                        if bulkFile.read().strip() != '-1':
+                            break
+                    
+                    if time.time() >= deadline:
+                        self.__log("Bulk conversion on %s didn't finish within %s sec." %(bulkNode, self.__bulkTimeout))
+                        break
+                    
+                    time.sleep(self.__bulkPoll)
+            
+            except (IOError, OSError) as e:
+                # The bus master went away mid-sweep. Its sensors will convert per sensor if they can be read at all.
+                self.__log("Lost bulk conversion node %s: %s" %(bulkNode, e))
+    
+    def __log(self, message):
+        """
+        Log a message if we have a logger.
+        """
+        
+        if self.__logger != None:
+            self.__logger.log(message)
+    
     def readTemp(self, address):
         """
         Read temperature value from the sensor. Returns a float representing teperature in degrees Celcius.
@@ -66,3 +154,10 @@ class ds18b20:
             raise IOError("Missing temperature data from DS18B20 at " + address)
         
         return tempC
+    
+    def readFresh(self, address):
+        """
+        Read temperature value from the sensor on demand, between sweeps. Outside a bulk conversion each read of the sensor does its own conversion, so this is the same as readTemp().
+        """
+        
+        return self.readTemp(address)
@@ -0,0 +1,239 @@
+"""
+Simulated DS18B20 temperature sensors for load and analytics testing without 1-Wire hardware.
+
+Values for every virtual sensor are generated together once per sweep from a seeded random number generator, so a given seed, sensor set, and tick count always produce the same readings. On-demand reads with readFresh() sample the model from their own random stream, so they never change what the sweeps see.
+"""
+
+import math
+import time
+import random
+import zlib
+
+class ds18b20Sim:
+    
+    def __init__(self, seed=395803958, timeStep=None, minPoll=0.750, startHour=0.0, crcRate=0.001, dropoutRate=0.0001, resetRate=0.0005, meta=None):
+        """
+        Simulated drop-in replacement for the ds18b20 class. Each virtual sensor has its own base temperature, diurnal cycle, mean-reverting drift, and noise, and can be hit with CRC errors, dropouts, and power-on resets.
+        seed: seed for all generated values.
+        timeStep: simulated seconds that pass per sweep. Defaults to minPoll for real time; larger values compress days into minutes.
+        minPoll: seconds between sweeps.
+        startHour: simulated hour of day (UTC) at the first sweep.
+        crcRate: per-reading probability of a CRC error.
+        dropoutRate: per-reading probability of a sensor dropping off the bus for a while.
+        resetRate: per-reading probability of the 85 C power-on reset value.
+        meta: sensor metadata with 'min' and 'max' to clamp readings to. Defaults to the DS18B20 range.
+        """
+        
+        # Minimum time we wait before polling again.
+        self.minPoll = minPoll
+        
+        # Simulation settings.
+        self.__seed = seed
+        self.__timeStep = timeStep if timeStep != None else minPoll
+        self.__startTime = startHour * 3600.0
+        self.__crcRate = crcRate
+        self.__dropoutRate = dropoutRate
+        self.__resetRate = resetRate
+        
+        # Clamp to the sensor range.
+        if meta == None:
+            meta = {'min': -55, 'max': 125}
+        
+        self.__minTemp = meta['min']
+        self.__maxTemp = meta['max']
+        
+        # Per-tick random stream.
+        self.__rng = random.Random(seed)
+        
+        # Separate stream for on-demand reads so they don't change the sweeps.
+        self.__freshRng = random.Random(seed + 1)
+        
+        # Sweep counter.
+        self.__tick = 0
+        
+        # Index of each virtual sensor in the state lists below.
+        self.__index = {}
+        
+        # Per-sensor model parameters and state, stored as parallel lists so a sweep is one pass.
+        self.__base = []
+        self.__amplitude = []
+        self.__phase = []
+        self.__driftStep = []
+        self.__noise = []
+        self.__drift = []
+        self.__deadUntil = []
+        
+        # Results of the current sweep. Each is a float temperature or an exception to raise.
+        self.__values = []
+        
+        # When the current sweep was generated.
+        self.__sweepTime = None
+    
+    def virtualAddresses(self, count):
+        """
+        Returns a list of count 1-Wire style addresses for virtual sensors.
+        """
+        
+        return ['28-5100%08x' %i for i in range(count)]
+    
+    def __addSensor(self, address):
+        """
+        Set up the model for a new virtual sensor. Parameters are derived from the seed and address so they don't depend on registration order.
+        """
+        
+        paramRng = random.Random(zlib.crc32(("%s:%s" %(self.__seed, address)).encode('utf-8')))
+        
+        index = len(self.__base)
+        
+        # Most sensors sit indoors at room temperature with a small daily swing, a few see a large one.
+        self.__base.append(paramRng.uniform(12.0, 26.0))
+        self.__amplitude.append(paramRng.choice((0.3, 0.5, 1.0, 2.0, 8.0)) * paramRng.uniform(0.5, 1.5))
+        self.__phase.append(paramRng.uniform(-0.5, 0.5))
+        self.__driftStep.append(paramRng.uniform(0.002, 0.02) * math.sqrt(self.__timeStep))
+        self.__noise.append(paramRng.uniform(0.02, 0.1))
+        self.__drift.append(0.0)
+        self.__deadUntil.append(-1)
+        
+        # Only make the sensor visible to readers once its state exists.
+        self.__index[address] = index
+    
+    def startSweep(self, addresses):
+        """
+        Generate the next batch of readings for every virtual sensor. Sensors in addresses that haven't been seen before are added first.
+        """
+        
+        # Add new sensors in sorted order so the random stream is reproducible.
+        for address in sorted(addresses):
+            if address not in self.__index:
+                self.__addSensor(address)
+        
+        # Work out where we are in the simulated day. The sine peaks mid-afternoon.
+        simTime = self.__startTime + (self.__tick * self.__timeStep)
+        dayAngle = 2.0 * math.pi * (((simTime % 86400.0) / 86400.0) - 0.375)
+        
+        # Local references keep the per-sensor loop tight.
+        rng = self.__rng
+        gauss = rng.gauss
+        uniform = rng.random
+        tick = self.__tick
+        base = self.__base
+        amplitude = self.__amplitude
+        phase = self.__phase
+        driftStep = self.__driftStep
+        noise = self.__noise
+        drift = self.__drift
+        deadUntil = self.__deadUntil
+        minTemp = self.__minTemp
+        maxTemp = self.__maxTemp
+        crcRate = self.__crcRate
+        dropoutRate = self.__dropoutRate
+        resetRate = self.__resetRate
+        
+        values = [None] * len(base)
+        
+        for i in range(len(base)):
+            # Drift is a random walk pulled back towards zero.
+            drift[i] = (drift[i] * 0.999) + gauss(0.0, driftStep[i])
+            
+            tempC = base[i] + (amplitude[i] * math.sin(dayAngle + phase[i])) + drift[i] + gauss(0.0, noise[i])
+            
+            # Clamp and quantize to the 12-bit 0.0625 C resolution, reported in millidegrees like the kernel does.
+            tempC = min(max(tempC, minTemp), maxTemp)
+            values[i] = int(tempC / 0.0625) * 62.5 / 1000.0
+            
+            # Roll for faults.
+            faultRoll = uniform()
+            
+            if faultRoll < dropoutRate:
+                # Drop off the bus for a while.
+                deadUntil[i] = tick + int(rng.uniform(10, 200))
+            
+            elif faultRoll < (dropoutRate + crcRate):
+                values[i] = ValueError("Bad CRC value from DS18B20")
+            
+            elif faultRoll < (dropoutRate + crcRate + resetRate):
+                values[i] = 85.0
+            
+            if deadUntil[i] >= tick:
+                values[i] = IOError("Missing temperature data from DS18B20")
+        
+        self.__values = values
+        self.__sweepTime = time.time()
+        self.__tick += 1
+    
+    def __sampleTemp(self, i):
+        """
+        Generate an on-demand value for the sensor at index i from where the simulation is right now, between sweeps.
+        """
+        
+        rng = self.__freshRng
+        
+        # A sensor that's off the bus stays off the bus.
+        if self.__deadUntil[i] >= (self.__tick - 1):
+            return IOError("Missing temperature data from DS18B20")
+        
+        # Move the simulated clock on from the last sweep in proportion to the real time that's passed, up to the next sweep.
+        sweepTime = self.__sweepTime
+        
+        if sweepTime == None:
+            elapsed = 0.0
+        
+        else:
+            elapsed = min(max(time.time() - sweepTime, 0.0) / self.minPoll, 1.0) * self.__timeStep
+        
+        simTime = self.__startTime + ((self.__tick - 1) * self.__timeStep) + elapsed
+        dayAngle = 2.0 * math.pi * (((simTime % 86400.0) / 86400.0) - 0.375)
+        
+        tempC = self.__base[i] + (self.__amplitude[i] * math.sin(dayAngle + self.__phase[i])) + self.__drift[i] + rng.gauss(0.0, self.__noise[i])
+        tempC = min(max(tempC, self.__minTemp), self.__maxTemp)
+        
+        # Roll for faults.
+        faultRoll = rng.random()
+        
+        if faultRoll < self.__crcRate:
+            return ValueError("Bad CRC value from DS18B20")
+        
+        elif faultRoll < (self.__crcRate + self.__resetRate):
+            return 85.0
+        
+        return int(tempC / 0.0625) * 62.5 / 1000.0
+    
+    def readTemp(self, address):
+        """
+        Read temperature value from the simulated sensor for the current sweep. Returns a float representing teperature in degrees Celcius, or raises the same exceptions as ds18b20.readTemp().
+        """
+        
+        # Sensors we've never swept don't exist on the bus.
+        if address not in self.__index:
+            raise IOError("Missing temperature data from DS18B20 at " + address)
+        
+        values = self.__values
+        i = self.__index[address]
+        
+        # Added since the last sweep.
+        if i >= len(values):
+            raise IOError("Missing temperature data from DS18B20 at " + address)
+        
+        return self.__checkValue(values[i], address)
+    
+    def readFresh(self, address):
+        """
+        Read the simulated sensor on demand, between sweeps. Returns and raises the same as readTemp() but never uses or changes the sweep's values.
+        """
+        
+        # Sensors we've never swept don't exist on the bus.
+        if address not in self.__index:
+            raise IOError("Missing temperature data from DS18B20 at " + address)
+        
+        return self.__checkValue(self.__sampleTemp(self.__index[address]), address)
+    
+    def __checkValue(self, value, address):
+        """
+        Return a generated value, or raise it if it's a simulated fault.
+        """
+        
+        # Raise simulated faults.
+        if isinstance(value, Exception):
+            raise value.__class__("%s at %s" %(value, address))
+        
+        return value
@@ -0,0 +1,184 @@
+"""
+sensProfiler by ThreeSixes (https://github.com/ThreeSixes)
+
+This project is licensed under GPLv3. See COPYING for dtails.
+
+Opt-in profiler for sensorNet poll sweeps and HTTP requests.
+"""
+
+# Imports
+import os
+import math
+import datetime
+import threading
+import traceback
+import cProfile
+import pstats
+
+# Main class
+class sensProfiler():
+    """
+    sensProfiler profiling class. Profiles labelled calls for a bounded window and writes the results to disk.
+    """
+    
+    def __init__(self, logger, outDir=".", window=30, maxWindow=300):
+        """
+        sensProfiler constructor. Accepts a sensLog instance, a directory to write profiles to, and the default and longest profiling windows in seconds.
+        """
+        
+        self.__logger = logger
+        
+        # Where we write profile data.
+        self.__outDir = outDir
+        
+        # Default and longest window lengths in seconds.
+        self.__window = window
+        self.__maxWindow = maxWindow
+        
+        # Are we profiling right now? This is the only thing checked on the hot path when idle.
+        self.__active = False
+        
+        # Aggregated pstats.Stats objects keyed by label.
+        self.__stats = {}
+        
+        # Count of profiled calls keyed by label.
+        self.__calls = {}
+        
+        # Protects the aggregated stats and window state.
+        self.__lock = threading.Lock()
+        
+        # Timer that ends the current window.
+        self.__timer = None
+    
+    def isActive(self):
+        """
+        Returns True if a profiling window is open.
+        """
+        
+        return self.__active
+    
+    def start(self, window=None):
+        """
+        Open a profiling window for window seconds, or the default window if not specified. Windows longer than the maximum are cut short. Returns False if a window is already open and raises ValueError if window isn't a positive number.
+        """
+        
+        if window == None:
+            window = self.__window
+        
+        # A window that never closes would grow the stats forever and never write them.
+        if math.isnan(window) or math.isinf(window) or (window <= 0):
+            raise ValueError("Profiling window must be a positive number of seconds, not %s." %window)
+        
+        window = min(window, self.__maxWindow)
+        
+        with self.__lock:
+            # Only one window at a time.
+            if self.__active:
+                return False
+            
+            self.__stats = {}
+            self.__calls = {}
+            self.__active = True
+            
+            # Close the window when time's up.
+            self.__timer = threading.Timer(window, self.stop)
+            self.__timer.daemon = True
+            self.__timer.start()
+        
+        self.__logger.log("Profiling for %s sec." %window)
+        
+        return True
+    
+    def stop(self):
+        """
+        Close the profiling window and write out the results.
+        """
+        
+        with self.__lock:
+            if not self.__active:
+                return
+            
+            self.__active = False
+            
+            # Cancel the timer if we were stopped early.
+            if self.__timer != None:
+                self.__timer.cancel()
+                self.__timer = None
+            
+            stats = self.__stats
+            calls = self.__calls
+            self.__stats = {}
+            self.__calls = {}
+        
+        self.__writeStats(stats, calls)
+    
+    def run(self, label, func, *args):
+        """
+        Call func with args, profiling it under label if a window is open.
+        """
+        
+        # Keep this cheap when we're not profiling.
+        if not self.__active:
+            return func(*args)
+        
+        profile = cProfile.Profile()
+        
+        try:
+            return profile.runcall(func, *args)
+        
+        finally:
+            self.__addProfile(label, profile)
+    
+    def __addProfile(self, label, profile):
+        """
+        Merge a finished profile into the aggregated stats for label.
+        """
+        
+        try:
+            with self.__lock:
+                # The window may have closed while this call was running.
+                if not self.__active:
+                    return
+                
+                if label in self.__stats:
+                    self.__stats[label].add(profile)
+                    self.__calls[label] += 1
+                
+                else:
+                    self.__stats[label] = pstats.Stats(profile)
+                    self.__calls[label] = 1
+        
+        except:
+            tb = traceback.format_exc()
+            self.__logger.log("Caught exception trying to aggregate profile:\n%s" %tb)
+    
+    def __writeStats(self, stats, calls):
+        """
+        Write a .prof file and a text call summary for each label.
+        """
+        
+        # Timestamp for the file names.
+        fileTs = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        
+        if stats == {}:
+            self.__logger.log("Profiling window closed with nothing profiled.")
+        
+        for label in stats:
+            # Include the PID so pre-forked HTTP workers don't overwrite each other.
+            basePath = os.path.join(self.__outDir, "sensorNet-%s-%s-%s" %(label, os.getpid(), fileTs))
+            
+            try:
+                # Raw profile data for pstats, snakeviz, etc.
+                stats[label].dump_stats(basePath + ".prof")
+                
+                # Human-readable summary sorted by cumulative time.
+                with open(basePath + ".txt", 'w') as txtFile:
+                    txtFile.write("%s profiled calls: %s\n\n" %(label, calls[label]))
+                    stats[label].stream = txtFile
+                    stats[label].sort_stats('cumulative').print_stats(40)
+                
+                self.__logger.log("Wrote profile for %s %s calls to %s.prof" %(calls[label], label, basePath))
+            
+            except:
+                tb = traceback.format_exc()
+                self.__logger.log("Caught exception trying to write profile %s:\n%s" %(basePath, tb))
@@ -0,0 +1,304 @@
+"""
+Shared-memory sensor snapshot for pre-forked HTTP workers.
+
+The poller publishes each sweep as JSON into an anonymous shared mapping guarded by a seqlock. Worker processes forked after the mapping is created read it without taking any locks. Anything that needs the sensor bus is sent to the poller over a Unix socket.
+"""
+
+import os
+import mmap
+import json
+import time
+import zlib
+import struct
+import socket
+import threading
+import traceback
+import SocketServer
+from collections import OrderedDict
+
+# Header layout: sequence number, readings JSON length, metadata JSON length, payload CRC32.
+headerFmt = '<IIII'
+headerLen = struct.calcsize(headerFmt)
+
+class sharedSnapshot:
+    
+    def __init__(self, logger, size=4194304):
+        """
+        Create a shared snapshot segment of size bytes. This must be created before forking the processes that read it.
+        """
+        
+        self.__logger = logger
+        
+        # Anonymous mappings are shared with child processes after fork().
+        self.__shm = mmap.mmap(-1, size)
+        self.__size = size
+        
+        # Our copy of the sequence number. Only the publishing process writes.
+        self.__seq = 0
+        
+        # Serializes publishers within this process.
+        self.__lock = threading.Lock()
+    
+    def publish(self, readingsJson, metaJson):
+        """
+        Publish JSON-encoded readings and sensor metadata to readers.
+        """
+        
+        # json.dumps() output is ASCII, so byte strings can go in as they are. Encoding them again is most of the cost of publishing.
+        readingsData = readingsJson if isinstance(readingsJson, bytes) else readingsJson.encode('utf-8')
+        metaData = metaJson if isinstance(metaJson, bytes) else metaJson.encode('utf-8')
+        data = readingsData + metaData
+        
+        # Keep the last snapshot if the new one doesn't fit.
+        if (len(data) + headerLen) > self.__size:
+            self.__logger.log("Snapshot of %s bytes doesn't fit in the %s byte shared segment. Raise shmSize." %(len(data), self.__size))
+            return
+        
+        crc = zlib.crc32(data) & 0xffffffff
+        
+        with self.__lock:
+            # An odd sequence number tells readers a write is in progress.
+            seq = (self.__seq + 1) & 0xffffffff
+            struct.pack_into('<I', self.__shm, 0, seq)
+            
+            self.__shm[headerLen:headerLen + len(data)] = data
+            struct.pack_into('<III', self.__shm, 4, len(readingsData), len(metaData), crc)
+            
+            # Even again, we're done.
+            self.__seq = (seq + 1) & 0xffffffff
+            struct.pack_into('<I', self.__shm, 0, self.__seq)
+    
+    def getSeq(self):
+        """
+        Get the current sequence number. Readers use this to tell whether their cached copy is still current.
+        """
+        
+        return struct.unpack_from('<I', self.__shm, 0)[0]
+    
+    def read(self, retries=1000):
+        """
+        Returns a tuple of the sequence number, readings JSON, and metadata JSON of a consistent snapshot. The JSON is None if nothing has been published.
+        """
+        
+        for attempt in range(retries):
+            seqStart, readingsLen, metaLen, crc = struct.unpack_from(headerFmt, self.__shm, 0)
+            
+            # Wait out a write in progress.
+            if seqStart & 1:
+                time.sleep(0.0001)
+                continue
+            
+            # Nothing published yet.
+            if seqStart == 0:
+                return (0, None, None)
+            
+            data = self.__shm[headerLen:headerLen + readingsLen + metaLen]
+            
+            # Python gives us no memory barriers, so check the payload too.
+            if (struct.unpack_from('<I', self.__shm, 0)[0] == seqStart) and ((zlib.crc32(data) & 0xffffffff) == crc):
+                return (seqStart, data[:readingsLen], data[readingsLen:])
+        
+        raise RuntimeError("Unable to get a consistent read of the shared snapshot after %s tries." %retries)
+
+
+class pollerLinkHandler(SocketServer.StreamRequestHandler):
+    
+    def handle(self):
+        """
+        Handle one JSON request line from a worker and reply with a JSON line holding the HTTP status and data.
+        """
+        
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            status, data = self.server.handlers[request['op']](request)
+        
+        except:
+            status, data = 500, None
+            
+            tb = traceback.format_exc()
+            self.server.logger.log("Caught exception handling worker request:\n%s" %tb)
+        
+        try:
+            self.wfile.write((json.dumps({'status': status, 'data': data}) + "\n").encode('utf-8'))
+        
+        except:
+            # The worker gave up on us.
+            tb = traceback.format_exc()
+            self.server.logger.log("Caught exception replying to worker:\n%s" %tb)
+
+
+class pollerLinkServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    # Don't hold up shutdown for a slow sensor read.
+    daemon_threads = True
+
+
+class pollerLink:
+    
+    def __init__(self, logger, handlers):
+        """
+        Listen for requests from HTTP workers to the poller process. handlers maps each request's 'op' to a function that takes the request dictionary and returns a tuple of HTTP status and JSON-encodable data. This must be created before forking the workers.
+        """
+        
+        self.__logger = logger
+        
+        # Abstract socket name, so there's no file to clean up.
+        self.address = '\0sensorNet-%s' %os.getpid()
+        
+        self.__server = pollerLinkServer(self.address, pollerLinkHandler)
+        self.__server.handlers = handlers
+        self.__server.logger = logger
+        
+        self.__thread = None
+    
+    def start(self):
+        """
+        Start answering worker requests in the background.
+        """
+        
+        self.__thread = threading.Thread(target=self.__server.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+    
+    def stop(self):
+        """
+        Stop answering worker requests.
+        """
+        
+        if self.__thread != None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        
+        self.__server.server_close()
+    
+    def closeListener(self):
+        """
+        Close our copy of the listening socket. Workers call this after forking.
+        """
+        
+        self.__server.socket.close()
+
+
+def pollerRequest(address, request, timeout):
+    """
+    Send a request dictionary to the pollerLink at address and return its reply as a tuple of HTTP status and data. Raises IOError if the poller doesn't answer within timeout seconds.
+    """
+    
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    
+    try:
+        sock.connect(address)
+        sock.sendall((json.dumps(request) + "\n").encode('utf-8'))
+        reply = sock.makefile('rb').readline()
+    
+    finally:
+        sock.close()
+    
+    # The poller hung up without answering.
+    if not reply:
+        raise IOError("No reply from the poller.")
+    
+    reply = json.loads(reply.decode('utf-8'))
+    
+    return (reply['status'], reply['data'])
+
+
+class snapshotView:
+    
+    def __init__(self, shared, pollerAddress):
+        """
+        Read-only stand-in for thermalNetwork in HTTP worker processes, backed by a sharedSnapshot. On-demand reads are sent to the pollerLink at pollerAddress.
+        """
+        
+        self.__shared = shared
+        self.__pollerAddress = pollerAddress
+        
+        # The last snapshot we read as a dictionary with its sequence number, JSON, and decoded copies.
+        self.__cache = {'seq': None, 'readingsJson': '{}', 'metaJson': '{}', 'readings': {}, 'meta': {}}
+    
+    def __getSnapshot(self):
+        """
+        Get the current snapshot, only copying it out of shared memory when a new sweep has been published.
+        """
+        
+        cache = self.__cache
+        
+        # Still current?
+        if self.__shared.getSeq() == cache['seq']:
+            return cache
+        
+        seq, readingsJson, metaJson = self.__shared.read()
+        
+        if readingsJson == None:
+            cache = {'seq': seq, 'readingsJson': '{}', 'metaJson': '{}', 'readings': {}, 'meta': {}}
+        
+        else:
+            # Only decode when someone asks for a single sensor.
+            cache = {'seq': seq, 'readingsJson': readingsJson, 'metaJson': metaJson, 'readings': None, 'meta': None}
+        
+        self.__cache = cache
+        
+        return cache
+    
+    def __decode(self, cache, key):
+        """
+        Decode the readings or meta JSON from a snapshot, keeping key order so our responses are byte-for-byte what the poller would have sent.
+        """
+        
+        if cache[key] == None:
+            cache[key] = json.loads(cache[key + 'Json'], object_pairs_hook=OrderedDict)
+        
+        return cache[key]
+    
+    def getReadingsJson(self):
+        """
+        Get all sensor readings as JSON.
+        """
+        
+        return self.__getSnapshot()['readingsJson']
+    
+    def getReadings(self):
+        """
+        Get a dictionary containg sensor readings.
+        """
+        
+        return self.__decode(self.__getSnapshot(), 'readings')
+    
+    def getSensorMeta(self, target='all'):
+        """
+        Get sensor metadata as a dictionary, or None if the target sensor doesn't exist.
+        """
+        
+        meta = self.__decode(self.__getSnapshot(), 'meta')
+        
+        if target == 'all':
+            return meta
+        
+        if target in meta:
+            return {target: meta[target]}
+        
+        return None
+    
+    def readFresh(self, address, timeout=10.0):
+        """
+        Have the poller process read one sensor now, since only it has the sensor bus. The poller writes the reading back and publishes a new snapshot before it answers. Returns and raises the same as thermalNetwork.readFresh().
+        """
+        
+        # Unknown sensors are still unknown.
+        if self.getSensorMeta(address) == None:
+            raise KeyError(address)
+        
+        # Give the poller a little longer than it gives the read.
+        status, data = pollerRequest(self.__pollerAddress, {'op': 'fresh', 'address': address, 'timeout': timeout}, timeout + 1.0)
+        
+        if status == 200:
+            return data
+        
+        elif status == 429:
+            return None
+        
+        elif status == 404:
+            raise KeyError(address)
+        
+        raise IOError(data)
@@ -7,60 +7,165 @@ except:
 
 import threading
 import re
+import os
+import time
+import socket
 import json
 import traceback
 import datetime
+import signal
+import multiprocessing
 from sensLog import sensLog
+from sensProfiler import sensProfiler
 from thermalNetwork import thermalNetwork
+from ds18b20Sim import ds18b20Sim
+from sensShm import sharedSnapshot, snapshotView, pollerLink, pollerRequest
 from BaseHTTPServer import BaseHTTPRequestHandler,HTTPServer
 from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
 from pprint import pprint
 
 # Override the HTTPRequestHandler
 class HTTPRequestHandler(BaseHTTPRequestHandler):
-    # Do nothing if we get POST data.
+    # Handle admin POSTs. Do nothing with any other POST data.
     def do_POST(self):
-        pass
-
-    # Handle GETs.
+        # Split the query string off.
+        url = urlparse(self.path)
+        
+        # Start a profiling window if profiling is enabled and we're allowed to.
+        if url.path == '/v1/admin/profile':
+            # Hold the data we want to try sending.
+            sendData = None
+            
+            try:
+                if (profiler == None) or (self.client_address[0] not in snConfig['profiling']['adminIPs']):
+                    # Pretend we don't exist.
+                    httpStatus = 404
+                
+                else:
+                    # Get the window length if we have one.
+                    query = parse_qs(url.query)
+                    window = None
+                    
+                    if 'seconds' in query:
+                        window = float(query['seconds'][0])
+                    
+                    if inWorker:
+                        # Sweeps run in the poller, so have it open the window and tell the workers.
+                        httpStatus, data = pollerRequest(workerLink.address, {'op': 'profile', 'seconds': window}, 5.0)
+                    
+                    else:
+                        httpStatus, data = profileRequest({'seconds': window})
+                    
+                    if data != None:
+                        sendData = json.dumps(data) + "\n"
+            
+            except ValueError:
+                # Bad window length.
+                httpStatus = 400
+                sendData = None
+            
+            except:
+                # HTTP 500.
+                httpStatus = 500
+                sendData = None
+                
+                tb = traceback.format_exc()
+                logger.log("Caught exception in do_POST():\n%s" %tb)
+            
+            self.__sendResponse(httpStatus, sendData)
+    
+    # Send a JSON response.
+    def __sendResponse(self, httpStatus, sendData):
+        try:
+            # Send the HTTP respnose code.
+            self.send_response(httpStatus)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            # If we have data.
+            if sendData != None:
+                # Send the data.
+                self.wfile.write(sendData)
+        
+        except:
+            tb = traceback.format_exc()
+            logger.log("Caught exception trying to send HTTP response:\n%s" %tb)
+    
+    # Handle GETs, profiling them if we're asked to.
     def do_GET(self):
+        if profiler != None:
+            profiler.run('http', self.__handleGet)
+        
+        else:
+            self.__handleGet()
+    
+    # Build and send GET responses.
+    def __handleGet(self):
         # Hold the data we want to try sending.
         sendData = None
         
         try:
+            # Split the query string off.
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            
             # If we request the proper thing send it.
-            if None != re.search('^/v1/thermal(/)?(.+)?$', self.path):
+            if None != re.search('^/v1/thermal(/)?(.+)?$', url.path):
                 
                 # Set newData to None by default.
                 newData = None
                 
                 # Get match chunks.
-                chunks = re.match('^/v1/thermal(/)?(.+)?$', self.path)
+                chunks = re.match('^/v1/thermal(/)?(.+)?$', url.path)
                 
                 # If we have a URL sans slash...
                 if (chunks.groups()[0] == None) and (chunks.groups()[1] == None):
                     # Set our HTTP status stuff.
                     httpStatus = 200
-                    sendData = json.dumps(thermalNet.getReadings()) + "\n"
+                    sendData = thermalNet.getReadingsJson() + "\n"
                     
                 elif (chunks.groups()[0] == "/") and (chunks.groups()[1] == None):
                     # Set our HTTP status stuff.
                     httpStatus = 200
-                    sendData = json.dumps(thermalNet.getReadings()) + "\n"
+                    sendData = thermalNet.getReadingsJson() + "\n"
                 
                 elif (chunks.groups()[0] == "/") and (chunks.groups()[1] != None):
                     # Grab the target sensor
                     targetSensor = chunks.groups()[1]
                     
+                    # 404 unless we find something.
+                    httpStatus = 404
+                    
                     try:
-                        # Get the new data from the end of the URL.
-                        newData = {targetSensor: thermalNet.getReadings()[targetSensor]}
+                        # Read it now if we're asked to.
+                        if query.get('fresh', ['0'])[0] not in ('', '0'):
+                            freshReading = thermalNet.readFresh(targetSensor)
+                            
+                            if freshReading != None:
+                                newData = {targetSensor: freshReading}
+                            
+                            else:
+                                # Too many on-demand reads in progress, or the last one failed too recently.
+                                httpStatus = 429
+                        
+                        else:
+                            # Get the new data from the end of the URL.
+                            newData = {targetSensor: thermalNet.getReadings()[targetSensor]}
                     
                     except KeyError:
                         # Set HTTP 404.
                         httpStatus = 404
                         sendData = None
                     
+                    except (IOError, ValueError) as e:
+                        # The read failed.
+                        httpStatus = 503
+                        sendData = None
+                        
+                        logger.log("On-demand read of %s failed: %s" %(targetSensor, e))
+                    
                     except Exception as e:
                         # Pass other exceptions back up.
                         raise e
@@ -72,8 +177,7 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
                         sendData = json.dumps(newData) + "\n"
                     
                     else:
-                        # Set HTTP 404.
-                        httpStatus = 404
+                        # Keep the error status from above.
                         sendData = None
                 
                 else:
@@ -82,10 +186,10 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
                     sendData = None
             
             # If we request the proper thing send it.
-            elif None != re.search('^/v1/sensors(/)?(.+)?$', self.path):
+            elif None != re.search('^/v1/sensors(/)?(.+)?$', url.path):
                 
                 # Get match chunks.
-                chunks = re.match('^/v1/sensors(/)?(.+)?$', self.path)
+                chunks = re.match('^/v1/sensors(/)?(.+)?$', url.path)
                 
                 # If we have a URL sans slash...
                 if (chunks.groups()[0] == None) and (chunks.groups()[1] == None):
@@ -136,21 +240,7 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
             tb = traceback.format_exc()
             logger.log("Caught exception in do_get():\n%s" %tb)
         
-        try:
-            # Send the HTTP respnose code.
-            self.send_response(httpStatus)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            
-            # If we have data.
-            if sendData != None:
-                # Send the data.
-                self.wfile.write(sendData)
-        
-        except:
-            tb = traceback.format_exc()
-            logger.log("Caught exception trying to send HTTP response:\n%s" %tb)
+        self.__sendResponse(httpStatus, sendData)
         
         return
     
@@ -164,10 +254,24 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     allow_reuse_address = True
     
+    # Set SO_REUSEPORT so several processes can listen on the same port?
+    reusePort = False
+    
+    def server_bind(self):
+        # Let the kernel balance connections across worker processes.
+        if self.reusePort:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        HTTPServer.server_bind(self)
+    
     def shutdown(self):
         # Close the socket and shut the server down.
         self.socket.close()
         HTTPServer.shutdown(self)
+
+# ThreadedHTTPServer for pre-forked workers sharing a port.
+class ReusePortHTTPServer(ThreadedHTTPServer):
+    reusePort = True
     
 # Override the SimpleHTTPServer
 class SimpleHttpServer():
@@ -195,10 +299,8 @@ class SimpleHttpServer():
             
             logger.log('Start sensor monitor.')
             
-            # Start the server thread.
-            self.tnThread = threading.Thread(target=thermalNet.run(snConfig['sensorMode']))
-            self.tnThread.daemon = True
-            self.tnThread.start()
+            # Start the supervised sensor engine in the background.
+            thermalNet.start(snConfig['sensorMode'])
         
         except KeyboardInterrupt:
             # Pass it up.
@@ -213,8 +315,9 @@ class SimpleHttpServer():
         
     def waitForThread(self):
         try:
-            # Join the thread.
-            self.server_thread.join()
+            # Join the thread with a timeout so signals still reach the main thread.
+            while self.server_thread.is_alive():
+                self.server_thread.join(1.0)
         
         except KeyboardInterrupt:
             # Pass it up.
@@ -228,6 +331,300 @@ class SimpleHttpServer():
         # Stop the server and wait for the threads to die.
         self.server.shutdown()
         self.waitForThread()
+        
+        # Write out any open profiling window.
+        if profiler != None:
+            profiler.stop()
+        
+        logger.log('Stop sensor monitor.')
+        
+        # Stop the sensor engine and checkpoint the last readings.
+        thermalNet.stop()
+        
+        if snConfig.get('snapshotFile'):
+            thermalNet.saveSnapshot(snConfig['snapshotFile'])
+
+
+# Pre-forked HTTP server. Worker processes serve from the shared snapshot while this process polls sensors.
+class PreforkHttpServer():
+    def __init__(self, ip, port, workers):
+        # Where we listen.
+        self.ip = ip
+        self.port = port
+        
+        # How many worker processes we want and their PIDs.
+        self.workers = workers
+        self.workerPids = []
+        
+        # Set when we're shutting down so we don't respawn workers.
+        self.stopping = False
+    
+    def spawnWorker(self):
+        pid = os.fork()
+        
+        if pid == 0:
+            # We're the worker.
+            self.runWorker()
+        
+        self.workerPids.append(pid)
+    
+    def runWorker(self):
+        global thermalNet
+        global inWorker
+        
+        inWorker = True
+        
+        # Serve from the shared snapshot instead of the engine, which only runs in the parent.
+        thermalNet = snapshotView(sharedSnap, workerLink.address)
+        
+        # Only the parent answers worker requests.
+        workerLink.closeListener()
+        
+        try:
+            server = ReusePortHTTPServer((self.ip, self.port), HTTPRequestHandler)
+            server.serve_forever()
+        
+        except KeyboardInterrupt:
+            pass
+        
+        except:
+            tb = traceback.format_exc()
+            logger.log("Exception in HTTP worker %s:\n%s" %(os.getpid(), tb))
+        
+        # Write out any open profiling window.
+        if profiler != None:
+            profiler.stop()
+        
+        # Never fall back into the parent's code.
+        os._exit(0)
+    
+    def start(self):
+        try:
+            logger.log('Start %s web server workers.' %self.workers)
+            
+            # Fork the workers before we start any threads.
+            for i in range(self.workers):
+                self.spawnWorker()
+            
+            # Answer on-demand reads for the workers.
+            workerLink.start()
+            
+            logger.log('Start sensor monitor.')
+            
+            # Start the supervised sensor engine in the background.
+            thermalNet.start(snConfig['sensorMode'])
+        
+        except KeyboardInterrupt:
+            # Pass it up.
+            raise KeyboardInterrupt
+        
+        except:
+            tb = traceback.format_exc()
+            logger.log("Exception thrown in start()\n%s" %tb)
+            
+            # Shut down.
+            self.stop()
+    
+    def signalWorkers(self, signum):
+        # Send a signal to every worker.
+        for pid in self.workerPids:
+            try:
+                os.kill(pid, signum)
+            
+            except OSError:
+                # Already gone.
+                pass
+    
+    def waitForThread(self):
+        try:
+            # Reap and respawn workers until we're told to stop.
+            while self.workerPids != []:
+                # Only reap our workers. The engine thread has children of its own.
+                for pid in list(self.workerPids):
+                    try:
+                        donePid, status = os.waitpid(pid, os.WNOHANG)
+                    
+                    except OSError:
+                        # Already reaped.
+                        donePid, status = pid, None
+                    
+                    if donePid == pid:
+                        self.workerPids.remove(pid)
+                        
+                        if not self.stopping:
+                            logger.log("HTTP worker %s exited with status %s, respawning." %(pid, status))
+                            self.spawnWorker()
+                
+                time.sleep(1.0)
+        
+        except KeyboardInterrupt:
+            # Pass it up.
+            raise KeyboardInterrupt
+        
+        except:
+            tb = traceback.format_exc()
+            logger.log("Exception in waithForThread():\n%s" %tb)
+    
+    def stop(self):
+        self.stopping = True
+        
+        # Stop the workers and wait for them to die.
+        self.signalWorkers(signal.SIGTERM)
+        
+        for pid in list(self.workerPids):
+            try:
+                os.waitpid(pid, 0)
+            
+            except OSError:
+                pass
+            
+            self.workerPids.remove(pid)
+        
+        # Nobody's left to ask us for anything.
+        workerLink.stop()
+        
+        # Write out any open profiling window.
+        if profiler != None:
+            profiler.stop()
+        
+        logger.log('Stop sensor monitor.')
+        
+        # Stop the sensor engine and checkpoint the last readings.
+        thermalNet.stop()
+        
+        if snConfig.get('snapshotFile'):
+            thermalNet.saveSnapshot(snConfig['snapshotFile'])
+
+
+# Watch the configuration file and apply sensor changes without restarting.
+class ConfigWatcher():
+    def __init__(self, interval):
+        # How often we check the file, in seconds.
+        self.interval = interval
+        
+        # Watch the source, not the compiled file.
+        self.path = os.path.splitext(config.__file__)[0] + '.py'
+        self.mtime = self.getMtime()
+        
+        # Set when we should stop watching.
+        self.stopEvent = threading.Event()
+    
+    def getMtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        
+        except OSError:
+            # Missing while it's being replaced, try again next time.
+            return None
+    
+    def start(self):
+        logger.log("Watching %s for sensor changes." %self.path)
+        
+        self.watchThread = threading.Thread(target=self.watch)
+        self.watchThread.daemon = True
+        self.watchThread.start()
+    
+    def stop(self):
+        self.stopEvent.set()
+        self.watchThread.join()
+    
+    def watch(self):
+        while not self.stopEvent.wait(self.interval):
+            mtime = self.getMtime()
+            
+            # Reload when the file changes.
+            if (mtime != None) and (mtime != self.mtime):
+                self.mtime = mtime
+                self.reloadConfig()
+    
+    def reloadConfig(self):
+        try:
+            reload(config)
+            newConfig = config.config
+            
+            # Only sensors can change on the fly.
+            for key in newConfig:
+                if (key != 'sensors') and (newConfig[key] != snConfig.get(key)):
+                    logger.log("Config setting %s changed. Restart sensorNet to apply it." %key)
+            
+            # Apply sensor changes, keeping any virtual sensors.
+            sensors = dict(virtualSensors)
+            sensors.update(newConfig['sensors'])
+            thermalNet.applySensorConfig(sensors)
+            
+            snConfig['sensors'] = newConfig['sensors']
+        
+        except KeyboardInterrupt:
+            # Pass it up.
+            raise KeyboardInterrupt
+        
+        except:
+            tb = traceback.format_exc()
+            logger.log("Failed to reload config, keeping the current sensors:\n%s" %tb)
+
+
+# Publish the latest sweep to the HTTP workers. Both JSON encodings are cached, so publishing after an on-demand read only re-encodes that reading.
+def publishSnapshot():
+    sharedSnap.publish(thermalNet.getReadingsJson(), thermalNet.getSensorMetaJson())
+
+# Do an on-demand read for an HTTP worker. The reading is published to the shared snapshot before we answer.
+def workerFreshRead(request):
+    try:
+        reading = thermalNet.readFresh(request['address'], request['timeout'])
+    
+    except KeyError:
+        return (404, None)
+    
+    except (IOError, ValueError) as e:
+        return (503, str(e))
+    
+    # Rate limited.
+    if reading == None:
+        return (429, None)
+    
+    return (200, reading)
+
+# Turn SIGTERM into a clean shutdown.
+def sigTermHandler(signum, frame):
+    raise KeyboardInterrupt
+
+# Open a profiling window here and in the HTTP workers. Returns False if one is already open.
+def startProfiling(window=None):
+    if not profiler.start(window):
+        return False
+    
+    # Have the workers profile their requests over the same window.
+    if workerWindow != None:
+        workerWindow.value = window if (window != None) else 0.0
+        server.signalWorkers(signal.SIGUSR1)
+    
+    return True
+
+# Start profiling for an admin request. 202 if we started, 409 if we're already profiling.
+def profileRequest(request):
+    if profiler == None:
+        return (404, None)
+    
+    try:
+        started = startProfiling(request['seconds'])
+    
+    except ValueError:
+        # Bad window length.
+        return (400, None)
+    
+    if started:
+        return (202, {'profiling': profiler.isActive()})
+    
+    return (409, {'profiling': profiler.isActive()})
+
+# Open a profiling window on SIGUSR1.
+def sigUsr1Handler(signum, frame):
+    if inWorker:
+        # The poller opened a window, profile our requests over it too.
+        profiler.start(workerWindow.value or None)
+    
+    else:
+        startProfiling()
 
 
 #######################
@@ -247,6 +644,33 @@ if __name__ == '__main__':
     # Set debuggging.
     thermalNet.setDebug(snConfig['debug'])
     
+    # Convert all sensors on a bus at once?
+    thermalNet.setBulkRead(snConfig.get('bulkRead', True))
+    
+    # Limit on-demand reads.
+    if 'freshRead' in snConfig:
+        thermalNet.setFreshLimits(snConfig['freshRead']['minInterval'], snConfig['freshRead']['maxInFlight'])
+    
+    # Set the dead sensor quarantine policy.
+    if 'quarantine' in snConfig:
+        thermalNet.setQuarantine(snConfig['quarantine']['failures'], snConfig['quarantine']['minBackoff'], snConfig['quarantine']['maxBackoff'])
+    
+    # Set up profiling if we want it.
+    profiler = None
+    
+    # Are we an HTTP worker process? Only set after forking.
+    inWorker = False
+    
+    # Profiling window shared with HTTP workers, when we have them.
+    workerWindow = None
+    
+    if snConfig.get('profiling', {}).get('enabled'):
+        profiler = sensProfiler(logger, snConfig['profiling']['outDir'], snConfig['profiling']['window'], snConfig['profiling'].get('maxWindow', 300))
+        thermalNet.setProfiler(profiler)
+        
+        # Profile on demand with kill -USR1.
+        signal.signal(signal.SIGUSR1, sigUsr1Handler)
+    
     try:
         # Register each configured sensor.
         for sensor in snConfig['sensors']:
@@ -262,14 +686,67 @@ if __name__ == '__main__':
         tb = traceback.format_exc()
         logger.log("Exception registering snesors:\n%s" %tb)
     
+    # Virtual sensors registered on top of the configured ones.
+    virtualSensors = {}
+    
+    # Set up simulated sensors if we're in dummy mode.
+    if (snConfig['sensorMode'] == 'dummy') and ('simulation' in snConfig):
+        simConfig = snConfig['simulation']
+        simulator = ds18b20Sim(simConfig['seed'], simConfig['timeStep'], startHour=simConfig['startHour'], crcRate=simConfig['crcRate'], dropoutRate=simConfig['dropoutRate'], resetRate=simConfig['resetRate'], meta=simConfig['sensorMeta'])
+        thermalNet.setSimulator(simulator)
+        
+        # Register virtual sensors.
+        for sensor in simulator.virtualAddresses(simConfig['sensors']):
+            virtualSensors[sensor] = {'loc': 'simulated', 'locDetail': sensor, 'sensorMeta': simConfig['sensorMeta']}
+            thermalNet.registerSensor(sensor, 'simulated', sensor, simConfig['sensorMeta'])
+        
+        logger.log("Simulating %s sensors." %len(thermalNet.getSensorMeta()))
+    
+    # Warm start from the last checkpoint so we can answer before the first sweep finishes.
+    if snConfig.get('snapshotFile'):
+        thermalNet.loadSnapshot(snConfig['snapshotFile'])
+    
+    # Shut down cleanly when we're told to terminate.
+    signal.signal(signal.SIGTERM, sigTermHandler)
+    
     # Create HTTP server class.
     logger.log("Init web server.")
-    server = SimpleHttpServer(snConfig['listenIP'], snConfig['listenPort'])
+    
+    if snConfig.get('httpWorkers', 1) > 1:
+        # Share each sweep with the worker processes.
+        sharedSnap = sharedSnapshot(logger, snConfig.get('shmSize', 4194304))
+        thermalNet.addSweepListener(publishSnapshot)
+        
+        # Publish what we have so the workers can answer right away.
+        publishSnapshot()
+        
+        # Let the workers ask us for on-demand reads and profiling.
+        workerLink = pollerLink(logger, {'fresh': workerFreshRead, 'profile': profileRequest})
+        
+        server = PreforkHttpServer(snConfig['listenIP'], snConfig['listenPort'], snConfig['httpWorkers'])
+        
+        # Tells the workers how long to profile for when we signal them.
+        workerWindow = multiprocessing.RawValue('d', 0.0)
+    
+    else:
+        server = SimpleHttpServer(snConfig['listenIP'], snConfig['listenPort'])
+    
     logger.log('Web server listening on %s:%s...' %(snConfig['listenIP'], snConfig['listenPort']))
     
+    # Config file watcher, if we want one.
+    watcher = None
+    
     try:
         # Bring up our server.
         server.start()
+        
+        # Pick up sensor changes without a restart.
+        if snConfig.get('configReloadInterval'):
+            watcher = ConfigWatcher(snConfig['configReloadInterval'])
+            watcher.start()
+        
+        # Wait for the server to exit.
+        server.waitForThread()
     
     except KeyboardInterrupt:
         logger.log("Caught keyboard exception. Shutting down.")
@@ -286,3 +763,7 @@ if __name__ == '__main__':
     
     # Wait for threads to exit for whatever
     server.waitForThread()
+    
+    # Stop watching the config file.
+    if watcher != None:
+        watcher.stop()
@@ -8,12 +8,18 @@ Simple temperature-based monitoring and control system for the Raspberry Pi.
 # Imports #
 ###########
 
+import sys
 import time
 import traceback
 import threading
-import random
 import datetime
+import json
+import os
+import struct
+import fcntl
+import termios
 from ds18b20 import ds18b20
+from ds18b20Sim import ds18b20Sim
 
 class thermalNetwork:
     def __init__(self, logger):
@@ -31,7 +37,10 @@ class thermalNetwork:
         self.__debugOn = False
         
         # Temperature sensor support
-        self.__tempSens = ds18b20()
+        self.__tempSens = ds18b20(logger)
+        
+        # Simulated sensors used in dummy mode.
+        self.__simSens = None
         
         # Temperature sensor registry
         self.__sensorSet = {}
@@ -39,8 +48,64 @@ class thermalNetwork:
         # Store readings and sensor data globally.
         self.__sensorReadings = {}
         
+        # JSON encoding of the readings and the readings dictionary it was made from.
+        self.__readingsJson = (None, None)
+        
+        # Per-sensor JSON fragments used to build the above, keyed by address, as (reading, JSON).
+        self.__readingsFragments = {}
+        
+        # Held while swapping in new readings.
+        self.__readingsLock = threading.Lock()
+        
+        # JSON encoding of all sensor metadata as (generation, JSON). Bumping the generation invalidates it.
+        self.__metaGeneration = 0
+        self.__sensorMetaJson = (None, None)
+        
         # Running flag. Set to false when we should die.
         self.__keepRunning = True
+        
+        # Set when the supervised engine has been asked to stop.
+        self.__stopEvent = threading.Event()
+        
+        # Supervisor thread for the engine when started with start().
+        self.__runThread = None
+        
+        # Initial and maximum delay in seconds before restarting a crashed engine.
+        self.__restartDelay = 1.0
+        self.__maxRestartDelay = 60.0
+        
+        # Optional sensProfiler instance for profiling sweeps.
+        self.__profiler = None
+        
+        # Functions called after each sweep.
+        self.__sweepListeners = []
+        
+        # Count of sweeps and other reading updates, and a condition to wait on for the next one.
+        self.__sweepCount = 0
+        self.__sweepCond = threading.Condition()
+        
+        # Per-sensor health records, and a lock held while reading or updating them since the sweep and on-demand reads both do.
+        self.__sensorHealth = {}
+        self.__healthLock = threading.Lock()
+        
+        # Smoothing factor for the health EWMAs.
+        self.__healthAlpha = 0.1
+        
+        # Quarantine a sensor after this many consecutive failed reads, then probe it with backoff between these bounds in seconds.
+        self.__quarantineAfter = 3
+        self.__minBackoff = 5.0
+        self.__maxBackoff = 300.0
+        
+        # On-demand reads in progress keyed by address, so concurrent requests for one sensor share a read.
+        self.__freshFlights = {}
+        self.__freshLock = threading.Lock()
+        
+        # The last on-demand read of each sensor as (time, reading), with a reading of None if it failed.
+        self.__freshReads = {}
+        
+        # Minimum seconds between on-demand reads of one sensor, and most on-demand reads on the bus at once.
+        self.__freshMinInterval = 0.750
+        self.__freshMaxInFlight = 4
     
     def setDebug(self, debugOn):
         """
@@ -54,15 +119,73 @@ class thermalNetwork:
         
         return
     
+    def setQuarantine(self, failures, minBackoff, maxBackoff):
+        """
+        Set the quarantine policy. A sensor is quarantined after failures consecutive failed reads and then probed with exponential backoff starting at minBackoff seconds, up to maxBackoff seconds.
+        """
+        
+        self.__quarantineAfter = failures
+        self.__minBackoff = minBackoff
+        self.__maxBackoff = maxBackoff
+        
+        return
+    
+    def setBulkRead(self, bulkRead):
+        """
+        Turn simultaneous bulk conversions across each 1-Wire bus on or off. Accepts one boolean argument.
+        """
+        
+        self.__tempSens.bulkRead = bulkRead
+        
+        return
+    
+    def setFreshLimits(self, minInterval, maxInFlight):
+        """
+        Limit on-demand reads to one per sensor every minInterval seconds and maxInFlight across the bus at once.
+        """
+        
+        self.__freshMinInterval = minInterval
+        self.__freshMaxInFlight = maxInFlight
+        
+        return
+    
+    def setSimulator(self, simulator):
+        """
+        Set the ds18b20Sim instance used to generate readings in dummy mode.
+        """
+        
+        self.__simSens = simulator
+        
+        return
+    
+    def setProfiler(self, profiler):
+        """
+        Set a sensProfiler instance used to profile sweeps. Accepts None to disable profiling.
+        """
+        
+        self.__profiler = profiler
+        
+        return
+    
+    def addSweepListener(self, callback):
+        """
+        Register a function to be called with no arguments after each sweep or other change to the readings.
+        """
+        
+        self.__sweepListeners.append(callback)
+        
+        return
+    
     def registerSensor(self, address, generalLoc, locDetail, meta):
         """
         Register a new temperature sensor
-        Accepts a sensor name and address.
+        Accepts a sensor name and address. Use applySensorConfig() to change sensors once the engine is running.
         """
         
         try:
             # Register the sensor in the dictionary.
             self.__sensorSet.update({address: {'loc': generalLoc, 'locDetail': locDetail, 'sensorMeta': meta}})
+            self.__metaGeneration += 1
             
             # Debug?
             if self.__debugOn:
@@ -80,6 +203,9 @@ class thermalNetwork:
         # Create an empty return value.
         retVal = None
         
+        # Use one sensor set throughout in case it's reconfigured while we work.
+        sensorSet = self.__sensorSet
+        
         try:
             # If we are supposed to scan all the sensors then scan them.
             if target == 'all':
@@ -87,15 +213,15 @@ class thermalNetwork:
                 retVal = {}
                 
                 # Loop and build the list.
-                for sensor in self.__sensorSet:
+                for sensor in sensorSet:
                     # Keep adding sensor metadata to the dictionary.
-                    retVal.update({sensor: self.__sensorSet[sensor]['sensorMeta']})
+                    retVal.update({sensor: self.__getMetaWithHealth(sensorSet, sensor)})
             
             else:
                 # Return data for the target server.
-                if target in self.__sensorSet:
+                if target in sensorSet:
                     # Get the target sensor.
-                    retVal = {target: self.__sensorSet[target]['sensorMeta']}
+                    retVal = {target: self.__getMetaWithHealth(sensorSet, target)}
         
         except:
             tb = traceback.format_exc()
@@ -103,6 +229,47 @@ class thermalNetwork:
         
         return retVal
     
+    def getSensorMetaJson(self):
+        """
+        Get metadata for all sensors as JSON. The encoding is cached until the next sweep or sensor change, so health updated by on-demand reads shows up after the next sweep.
+        """
+        
+        generation = self.__metaGeneration
+        cache = self.__sensorMetaJson
+        
+        if cache[0] != generation:
+            # Tag it with the generation we started with so a sweep finishing mid-encode isn't lost.
+            cache = (generation, json.dumps(self.getSensorMeta()))
+            self.__sensorMetaJson = cache
+        
+        return cache[1]
+    
+    def __getMetaWithHealth(self, sensorSet, address):
+        """
+        Get a copy of a sensor's metadata from sensorSet with its health added.
+        """
+        
+        # Copy since sensors can share a metadata dictionary.
+        meta = dict(sensorSet[address]['sensorMeta'])
+        
+        # Copy the health as one consistent record.
+        with self.__healthLock:
+            health = dict(self.__getHealth(address))
+        
+        # Make the probe time readable.
+        if health['nextProbe'] != None:
+            dts = str(datetime.datetime.utcfromtimestamp(health['nextProbe']))
+            
+            # Keep it looking pretty and uniform.
+            if len(dts) == 19:
+                dts = dts + ".000000"
+            
+            health['nextProbe'] = dts
+        
+        meta.update({'health': health})
+        
+        return meta
+    
     def getReadings(self):
         """
         Get a dictionary containg sensor readings.
@@ -111,30 +278,440 @@ class thermalNetwork:
         # Send all the readings!
         return self.__sensorReadings
     
-    def showReadingsCont(self):
+    def getReadingsJson(self):
+        """
+        Get all sensor readings as JSON. The encoding of each sensor's reading is cached until that reading changes.
+        """
+        
+        # Readings are swapped, never modified, so we can tell they changed by identity.
+        readings = self.__sensorReadings
+        cache = self.__readingsJson
+        
+        if cache[0] is not readings:
+            # Re-encode only the readings that changed.
+            oldFragments = self.__readingsFragments
+            fragments = {}
+            parts = []
+            
+            for address in readings:
+                fragment = oldFragments.get(address)
+                
+                if (fragment == None) or (fragment[0] is not readings[address]):
+                    fragment = (readings[address], json.dumps(address) + ": " + json.dumps(readings[address]))
+                
+                fragments[address] = fragment
+                parts.append(fragment[1])
+            
+            # This comes out the same as json.dumps(readings).
+            cache = (readings, "{" + ", ".join(parts) + "}")
+            self.__readingsFragments = fragments
+            self.__readingsJson = cache
+        
+        return cache[1]
+    
+    def readFresh(self, address, timeout=10.0):
+        """
+        Read one sensor now instead of waiting for the next sweep and write the reading back into the current readings. Concurrent calls for the same sensor share one read. If the sensor was read on demand less than the minimum interval ago that reading is returned instead.
+        Returns the reading, or None if too many on-demand reads are already in progress or the last on-demand read failed less than the minimum interval ago. Raises KeyError for unknown sensors and IOError or ValueError if the read fails.
+        """
+        
+        sensorSet = self.__sensorSet
+        
+        if address not in sensorSet:
+            raise KeyError(address)
+        
+        with self.__freshLock:
+            flight = self.__freshFlights.get(address)
+            leader = flight == None
+            
+            if leader:
+                # Serve a recent enough on-demand reading instead of hitting the bus again.
+                lastTime, lastReading = self.__freshReads.get(address, (0, None))
+                
+                if (time.time() - lastTime) < self.__freshMinInterval:
+                    # If it failed, make them wait rather than handing out an old sweep reading.
+                    return lastReading
+                
+                # Don't saturate the bus.
+                if len(self.__freshFlights) >= self.__freshMaxInFlight:
+                    return None
+                
+                # Quarantined sensors wait for their next probe.
+                if not self.__dueForRead(address, time.time()):
+                    raise IOError("Sensor %s is quarantined." %address)
+                
+                flight = {'done': threading.Event(), 'reading': None, 'error': None}
+                self.__freshFlights[address] = flight
+        
+        # Someone else is already reading it, wait for them.
+        if not leader:
+            if not flight['done'].wait(timeout):
+                raise IOError("Timed out waiting for on-demand read of %s." %address)
+            
+            if flight['error'] != None:
+                raise flight['error']
+            
+            return flight['reading']
+        
+        try:
+            # Get timestamp.
+            dts = str(datetime.datetime.utcnow())
+            
+            # Keep the log looking pretty and uniform.
+            if len(dts) == 19:
+                dts = dts + ".000000"
+            
+            # Time the read.
+            readStart = time.time()
+            
+            try:
+                flight['reading'] = {
+                    'dts': dts,
+                    'tempReading': self.__tempSens.readFresh(address),
+                    'loc': sensorSet[address]['loc'],
+                    'locDetail': sensorSet[address]['locDetail']
+                }
+                
+                self.__recordRead(address, time.time() - readStart, dts)
+            
+            except Exception as e:
+                # Pass the failure on to the followers too.
+                self.__recordRead(address, time.time() - readStart, dts, str(e))
+                flight['error'] = e
+                raise e
+            
+            finally:
+                # Rate limit failed reads as well as good ones.
+                with self.__freshLock:
+                    self.__freshReads[address] = (time.time(), flight['reading'])
+            
+            # Write it back to the readings.
+            with self.__readingsLock:
+                if address in self.__sensorSet:
+                    readings = dict(self.__sensorReadings)
+                    readings[address] = flight['reading']
+                    self.__sensorReadings = readings
+        
+        finally:
+            with self.__freshLock:
+                del self.__freshFlights[address]
+            
+            # Let the followers go.
+            flight['done'].set()
+        
+        # Readings changed so tell anyone who cares.
+        self.__notifySweep()
+        
+        return flight['reading']
+    
+    def applySensorConfig(self, sensors):
+        """
+        Bring the registered sensors in line with sensors, a dictionary in the same format as the 'sensors' configuration. Only added, removed, and changed sensors are touched and the current readings are updated to match without waiting for a sweep.
+        """
+        
+        added = []
+        removed = []
+        changed = []
+        
+        # Work on copies and swap them in so running sweeps and HTTP requests never see a half-applied change.
+        oldSet = self.__sensorSet
+        newSet = dict(oldSet)
+        
+        for address in oldSet:
+            if address not in sensors:
+                removed.append(address)
+                del newSet[address]
+        
+        for address in sensors:
+            newSensor = {'loc': sensors[address]['loc'], 'locDetail': sensors[address]['locDetail'], 'sensorMeta': sensors[address]['sensorMeta']}
+            
+            if address not in oldSet:
+                added.append(address)
+                newSet[address] = newSensor
+            
+            elif newSensor != oldSet[address]:
+                changed.append(address)
+                newSet[address] = newSensor
+        
+        # Nothing to do?
+        if (added == []) and (removed == []) and (changed == []):
+            return
+        
+        with self.__readingsLock:
+            self.__sensorSet = newSet
+            
+            # Drop readings of removed sensors and relabel changed ones. Untouched readings keep their cached JSON.
+            self.__sensorReadings = self.__reconcileReadings(self.__sensorReadings)
+        
+        # Forget the health of sensors that are gone.
+        with self.__healthLock:
+            for address in removed:
+                self.__sensorHealth.pop(address, None)
+        
+        with self.__freshLock:
+            for address in removed:
+                self.__freshReads.pop(address, None)
+        
+        # Sensors changed.
+        self.__metaGeneration += 1
+        
+        self.__logger.log("Applied sensor config: %s added, %s removed, %s changed." %(len(added), len(removed), len(changed)))
+        
+        if self.__debugOn:
+            self.__logger.log("Added: %s Removed: %s Changed: %s" %(added, removed, changed))
+        
+        # Readings changed so tell anyone who cares.
+        self.__notifySweep()
+    
+    def saveSnapshot(self, path):
+        """
+        Checkpoint the current sensor readings to a JSON file at path so they can be reloaded on the next start.
+        """
+        
+        # Get timestamp.
+        dts = str(datetime.datetime.utcnow())
+        
+        # Keep the log looking pretty and uniform.
+        if len(dts) == 19:
+            dts = dts + ".000000"
+        
+        # Write to a temporary file and rename it into place so a crash never leaves a half-written snapshot.
+        tmpPath = path + ".tmp"
+        
+        try:
+            with open(tmpPath, 'w') as snapFile:
+                json.dump({'saved': dts, 'readings': self.__sensorReadings}, snapFile)
+            
+            os.rename(tmpPath, path)
+            
+            # Debug?
+            if self.__debugOn:
+                self.__logger.log("Saved snapshot of %s readings to %s" %(len(self.__sensorReadings), path))
+        
+        except:
+            tb = traceback.format_exc()
+            self.__logger.log("Caught exception trying to save snapshot to %s:\n%s" %(path, tb))
+    
+    def loadSnapshot(self, path):
+        """
+        Load sensor readings from a snapshot created by saveSnapshot(). Readings are marked as stale until the first sweep replaces them. Only readings for registered sensors are loaded.
+        """
+        
+        # Hold readings.
+        readings = {}
+        
+        try:
+            # No snapshot yet is normal on the first start.
+            if not os.path.isfile(path):
+                if self.__debugOn:
+                    self.__logger.log("No snapshot found at %s" %path)
+                
+                return
+            
+            with open(path, 'r') as snapFile:
+                snapshot = json.load(snapFile)
+            
+            for tgtSens in snapshot['readings']:
+                # Skip sensors that are no longer configured.
+                if tgtSens in self.__sensorSet:
+                    reading = snapshot['readings'][tgtSens]
+                    reading.update({
+                        'stale': True,
+                        'loc': self.__sensorSet[tgtSens]['loc'],
+                        'locDetail': self.__sensorSet[tgtSens]['locDetail']
+                    })
+                    readings.update({tgtSens: reading})
+            
+            # Don't clobber a sweep that already finished.
+            if self.__sensorReadings == {}:
+                self.__sensorReadings = readings
+            
+            self.__logger.log("Loaded %s stale readings from snapshot %s saved %s" %(len(readings), path, snapshot['saved']))
+        
+        except:
+            tb = traceback.format_exc()
+            self.__logger.log("Caught exception trying to load snapshot from %s:\n%s" %(path, tb))
+    
+    def waitForSweep(self, lastSweep):
+        """
+        Block until the readings have been updated since sweep number lastSweep, or the engine stops. Returns the current sweep number.
+        """
+        
+        with self.__sweepCond:
+            # Wait in short slices. An untimed wait can't be interrupted by Ctrl-C on Python 2.
+            while (self.__sweepCount == lastSweep) and self.__keepRunning and not self.__stopEvent.is_set():
+                self.__sweepCond.wait(1.0)
+            
+            return self.__sweepCount
+    
+    def __wakeSweepWaiters(self, newSweep):
+        """
+        Wake up anything in waitForSweep(), counting a new sweep if newSweep is True.
+        """
+        
+        with self.__sweepCond:
+            if newSweep:
+                self.__sweepCount += 1
+            
+            self.__sweepCond.notify_all()
+    
+    def __getTermSize(self, out):
+        """
+        Get the size of the terminal as (rows, columns), or a sensible default if we can't tell.
+        """
+        
+        try:
+            rows, cols = struct.unpack('hh', fcntl.ioctl(out.fileno(), termios.TIOCGWINSZ, '1234'))
+            
+            if (rows > 0) and (cols > 0):
+                return (rows, cols)
+        
+        except:
+            pass
+        
+        return (24, 80)
+    
+    def __formatViewRow(self, address, sensor, reading, health, now):
+        """
+        Format one sensor's row for the live view.
+        """
+        
+        if reading != None:
+            tempText = "%.3f C" %reading['tempReading']
+            
+            # How old the reading is.
+            age = now - datetime.datetime.strptime(reading['dts'], "%Y-%m-%d %H:%M:%S.%f")
+            ageText = "%ds" %((age.days * 86400) + age.seconds)
+        
+        else:
+            tempText = "-"
+            ageText = "-"
+        
+        # Worst state first.
+        if health['state'] == 'quarantined':
+            stateText = "QUARANTINED: %s" %health['lastError']
+        
+        elif health['consecutiveFailures'] > 0:
+            stateText = "ERROR: %s" %health['lastError']
+        
+        elif (reading != None) and reading.get('stale'):
+            stateText = "stale"
+        
+        else:
+            stateText = "ok"
+        
+        return "%-16s %-14s %-14s %9s %6s  %s" %(address, sensor['loc'], sensor['locDetail'], tempText, ageText, stateText)
+    
+    def showReadingsCont(self, out=sys.stdout):
         """
-        Show temperature readings continuously.
+        Show a live view of the sensor readings with each reading's age and error state. The view blocks until each sweep finishes and only redraws rows that changed. On something other than a terminal only changed rows are written out. Returns when the engine stops.
         """
         
+        # Sensors on screen, in order, and the text of their rows.
+        shownSensors = None
+        shownLines = {}
+        
+        # Draw whatever we have right away.
+        lastSweep = None
+        
+        isTty = out.isatty()
+        
         try:
-            while True:
-                pass
+            while self.__keepRunning and not self.__stopEvent.is_set():
+                lastSweep = self.waitForSweep(lastSweep)
+                
+                # Woken up because we're stopping.
+                if (not self.__keepRunning) or self.__stopEvent.is_set():
+                    break
+                
+                # Work from one copy of everything.
+                sensorSet = self.__sensorSet
+                readings = self.__sensorReadings
+                meta = self.getSensorMeta()
+                now = datetime.datetime.utcnow()
+                
+                sensors = sorted(sensor for sensor in meta if sensor in sensorSet)
+                rows, cols = self.__getTermSize(out)
+                
+                # Leave room for the header and status lines.
+                if isTty:
+                    shown = sensors[:max(rows - 3, 1)]
+                
+                else:
+                    shown = sensors
+                
+                # Render the rows.
+                lines = {}
+                
+                for sensor in shown:
+                    lines[sensor] = self.__formatViewRow(sensor, sensorSet[sensor], readings.get(sensor), meta[sensor]['health'], now)
+                    
+                    # Don't wrap on a terminal.
+                    if isTty:
+                        lines[sensor] = lines[sensor][:cols - 1]
+                
+                if isTty:
+                    screen = []
+                    
+                    # Start over if the set of sensors on screen changed.
+                    if shown != shownSensors:
+                        screen.append("\x1b[2J\x1b[H")
+                        screen.append(("%-16s %-14s %-14s %9s %6s  %s" %('Sensor', 'Location', 'Detail', 'Temp', 'Age', 'State'))[:cols - 1])
+                        shownLines = {}
+                    
+                    # Only redraw rows that changed.
+                    for rowNum, sensor in enumerate(shown):
+                        if lines[sensor] != shownLines.get(sensor):
+                            screen.append("\x1b[%s;1H%s\x1b[K" %(rowNum + 2, lines[sensor]))
+                    
+                    # Status line.
+                    quarantined = len([sensor for sensor in sensors if meta[sensor]['health']['state'] == 'quarantined'])
+                    status = "Update %s at %s UTC: %s sensors, %s quarantined, %s not shown." %(lastSweep, now.strftime("%H:%M:%S"), len(sensors), quarantined, len(sensors) - len(shown))
+                    screen.append("\x1b[%s;1H%s\x1b[K" %(len(shown) + 3, status[:cols - 1]))
+                    
+                    out.write("".join(screen))
+                
+                else:
+                    for sensor in shown:
+                        if lines[sensor] != shownLines.get(sensor):
+                            out.write(lines[sensor] + "\n")
+                
+                out.flush()
+                
+                shownSensors = shown
+                shownLines = lines
         
         except Exception as e:
             # Pass exception up.
             raise e
-
+        
+        finally:
+            # Leave the cursor below the table so the shell prompt doesn't land in it.
+            if isTty and (shownSensors != None):
+                out.write("\x1b[%s;1H\n" %(len(shownSensors) + 3))
+                out.flush()
+    
     def __takeReadings(self):
         """
-        Take readings from sensors.
+        Take readings from sensors. Quarantined sensors are skipped until they're due for a probe.
         """
         
         # Hold readings.
         readings = {}
         
         try:
+            # Work from the sensor set as it is now, even if it's reconfigured mid-sweep.
+            sweepSet = self.__sensorSet
+            
+            # Skip quarantined sensors that aren't due to be probed.
+            now = time.time()
+            toRead = [tgtSens for tgtSens in sweepSet if self.__dueForRead(tgtSens, now)]
+            
+            # Let the sensor reader prepare for the sweep.
+            self.__tempSens.startSweep(toRead)
+            
             # Attempt to take readings.
-            for tgtSens in self.__sensorSet:
+            for tgtSens in toRead:
                 # Get timestamp.
                 dts = str(datetime.datetime.utcnow())
                 
@@ -142,65 +719,186 @@ class thermalNetwork:
                 if len(dts) == 19:
                     dts = dts + ".000000"
                 
+                # Time the read.
+                readStart = time.time()
+                
                 try:
                     # Update local readings.
                     readings.update({
                         tgtSens: {
                             'dts': dts,
                             'tempReading': self.__tempSens.readTemp(tgtSens),
-                            'loc': self.__sensorSet[tgtSens]['loc'],
-                            'locDetail': self.__sensorSet[tgtSens]['locDetail']
+                            'loc': sweepSet[tgtSens]['loc'],
+                            'locDetail': sweepSet[tgtSens]['locDetail']
                         }
                     })
+                    
+                    self.__recordRead(tgtSens, time.time() - readStart, dts)
                 
-                except RuntimeError:
-                    self.__logger.log("Sensor %s CRC error." %tgtSens)
+                except (ValueError, IOError) as e:
+                    # Bad CRC or missing data.
+                    self.__logger.log("Sensor %s read failed: %s" %(tgtSens, e))
+                    self.__recordRead(tgtSens, time.time() - readStart, dts, str(e))
                 
                 except:
                     tb = traceback.format_exc()
                     self.__logger.log("Exception reading sensor %s:\n%s" %(tgtSens, tb))
+                    self.__recordRead(tgtSens, time.time() - readStart, dts, tb.strip().split('\n')[-1])
             
-            # Set global readings from new values.
-            # Note: this is designed to be atomic so both old and new data don't coexist globally.
-            self.__sensorReadings = readings
+            with self.__readingsLock:
+                # Fix up readings for sensors that were reconfigured while we were sweeping.
+                if self.__sensorSet is not sweepSet:
+                    readings = self.__reconcileReadings(readings)
+                
+                # Keep on-demand readings taken after we read that sensor.
+                current = self.__sensorReadings
+                
+                for address, (freshTime, freshReading) in list(self.__freshReads.items()):
+                    if (freshTime > now) and (freshReading != None) and (address in current) and (address in readings) and (current[address]['dts'] > readings[address]['dts']):
+                        readings[address] = current[address]
+                
+                # Set global readings from new values.
+                # Note: this is designed to be atomic so both old and new data don't coexist globally.
+                self.__sensorReadings = readings
+                
+                # Health changed over the sweep.
+                self.__metaGeneration += 1
         
         except Exception as e:
             raise e
+        
+        # Tell anyone who cares.
+        self.__notifySweep()
     
-    def __fakeReadings(self):
+    def __reconcileReadings(self, readings):
         """
-        Fake readings from sensors.
+        Drop readings for sensors that are no longer registered and update the location of the rest to match the current sensor set.
         """
         
-        # Hold readings.
-        readings = {}
+        sensorSet = self.__sensorSet
+        reconciled = {}
         
-        try:
-            # Attempt to take readings.
-            for tgtSens in self.__sensorSet:
-                # Get timestamp.
-                dts = str(datetime.datetime.utcnow())
+        for address in readings:
+            if address in sensorSet:
+                reading = readings[address]
                 
-                # Keep the log looking pretty and uniform.
-                if len(dts) == 19:
-                    dts = dts + ".000000"
+                if (reading['loc'] != sensorSet[address]['loc']) or (reading['locDetail'] != sensorSet[address]['locDetail']):
+                    reading = dict(reading)
+                    reading.update({'loc': sensorSet[address]['loc'], 'locDetail': sensorSet[address]['locDetail']})
                 
-                # Update local readings.
-                readings.update({
-                    tgtSens: {
-                        'time': dts,
-                        'tempReading': random.randint(self.__sensorSet[tgtSens]['sensorMeta']['min'], self.__sensorSet[tgtSens]['sensorMeta']['max']),
-                        'loc': self.__sensorSet[tgtSens]['loc'],
-                        'locDetail': self.__sensorSet[tgtSens]['locDetail']
-                    }
-                })
+                reconciled[address] = reading
+        
+        return reconciled
+    
+    def __getHealth(self, address):
+        """
+        Get the health record for a sensor, creating it if needed.
+        """
+        
+        if address not in self.__sensorHealth:
+            # Callers hold the health lock.
+            self.__sensorHealth.setdefault(address, {
+                'state': 'ok',
+                'reads': 0,
+                'errors': 0,
+                'errorRate': 0.0,
+                'consecutiveFailures': 0,
+                'latencyEwma': None,
+                'lastError': None,
+                'lastSuccess': None,
+                'nextProbe': None,
+                'backoff': 0.0
+            })
+        
+        return self.__sensorHealth[address]
+    
+    def __dueForRead(self, address, now):
+        """
+        Returns True unless the sensor is quarantined and not yet due to be probed again.
+        """
+        
+        with self.__healthLock:
+            health = self.__getHealth(address)
             
-            # Set global readings from new values.
-            # Note: this is designed to be atomic so both old and new data don't coexist globally.
-            self.__sensorReadings = readings
+            return (health['state'] != 'quarantined') or (now >= health['nextProbe'])
+    
+    def __recordRead(self, address, latency, dts, error=None):
+        """
+        Update a sensor's health after a read, quarantining it or letting it back out as needed. error is None for a good read.
+        """
+        
+        # The sweep and on-demand reads both update health.
+        with self.__healthLock:
+            health = self.__getHealth(address)
+            alpha = self.__healthAlpha
+            
+            health['reads'] += 1
+            
+            # Latency EWMA, seeded with the first read.
+            if health['latencyEwma'] == None:
+                health['latencyEwma'] = latency
+            
+            else:
+                health['latencyEwma'] = ((1.0 - alpha) * health['latencyEwma']) + (alpha * latency)
+            
+            if error == None:
+                health['errorRate'] = (1.0 - alpha) * health['errorRate']
+                health['consecutiveFailures'] = 0
+                health['lastSuccess'] = dts
+                
+                # A good probe lets a quarantined sensor back in.
+                if health['state'] == 'quarantined':
+                    health['state'] = 'ok'
+                    health['nextProbe'] = None
+                    health['backoff'] = 0.0
+                    
+                    self.__logger.log("Sensor %s recovered, releasing it from quarantine." %address)
+            
+            else:
+                health['errors'] += 1
+                health['errorRate'] = ((1.0 - alpha) * health['errorRate']) + alpha
+                health['consecutiveFailures'] += 1
+                health['lastError'] = error
+                
+                if health['state'] == 'quarantined':
+                    # Failed probe, back off some more.
+                    health['backoff'] = min(health['backoff'] * 2, self.__maxBackoff)
+                    health['nextProbe'] = time.time() + health['backoff']
+                
+                elif health['consecutiveFailures'] >= self.__quarantineAfter:
+                    # Stop wasting bus time on it.
+                    health['state'] = 'quarantined'
+                    health['backoff'] = self.__minBackoff
+                    health['nextProbe'] = time.time() + health['backoff']
+                    
+                    self.__logger.log("Sensor %s failed %s times in a row, quarantining it." %(address, health['consecutiveFailures']))
         
-        except Exception as e:
-            raise e
+    
+    def __notifySweep(self):
+        """
+        Wake up anything waiting for a sweep and call the sweep listeners.
+        """
+        
+        self.__wakeSweepWaiters(True)
+        
+        for callback in self.__sweepListeners:
+            try:
+                callback()
+            
+            except:
+                tb = traceback.format_exc()
+                self.__logger.log("Caught exception in sweep listener:\n%s" %tb)
+    
+    def __runSweep(self, sweepFunc):
+        """
+        Run a sweep function, profiling it if we have a profiler.
+        """
+        
+        if self.__profiler != None:
+            self.__profiler.run('sweep', sweepFunc)
+        
+        else:
+            sweepFunc()
     
     def __worker(self):
         """
@@ -211,12 +909,12 @@ class thermalNetwork:
             self.__logger.log("In worker...")
         
         try:
-            while self.__keepRunning:
+            while self.__keepRunning and not self.__stopEvent.is_set():
                 # Grab all our readings.
-                self.__takeReadings()
+                self.__runSweep(self.__takeReadings)
                 
                 # Wait for sensor refresh timing to do it again.
-                time.sleep(self.__tempSens.minPoll)
+                self.__stopEvent.wait(self.__tempSens.minPoll)
         
         except KeyboardInterrupt:
             # Flag to shut down.
@@ -238,84 +936,43 @@ class thermalNetwork:
             # Pass it up the stack
             raise e
 
-    def __dummyWorker(self):
+    def __continuousSweeper(self):
         """
-        thermalNetwork worker that creates fake data..
+        Run the worker for continuous mode, waking the live view up if it dies.
         """
         
-        if self.__debugOn:
-            self.__logger.log("In dummy worker...")
-        
-        # Long hair, don't care.
-        random.seed(395803958)
-        
         try:
-            while self.__keepRunning:
-                # Grab all our readings.
-                self.__fakeReadings()
-                
-                # Wait for sensor refresh timing to do it again.
-                time.sleep(self.__tempSens.minPoll)
+            self.__worker()
         
-        except KeyboardInterrupt:
-            # Flag to shut down.
-            self.__keepRunning = False
-            
-            # pass it up the stack.
-            raise KeyboardInterrupt
+        except:
+            # The worker already logged it.
+            pass
         
-        except Exception as e:
-            # Flag to shut down.
+        finally:
             self.__keepRunning = False
-            
-            # Figure out what happened.
-            tb = traceback.format_exc()
-            
-            # Log it.
-            self.__logger.log("Exception in dummyWorker:\n%s" %tb)
-            
-            # Pass it up the stack
-            raise e
-
+            self.__wakeSweepWaiters(False)
+    
     def __contiuous(self):
         """
-        thermalNetwork continuous measurement mode.
+        thermalNetwork continuous measurement mode. Sweeps in the background and shows a live view of the readings.
         """
         if self.__debugOn:
             self.__logger.log("In continuous mode...")
         
-        try:
-            while self.__keepRunning:
-                # Grab all our readings.
-                self.__takeReadings()
-                
-                # Dump the readings.
-                for reading in self.__sensorReadings:
-                    if reading:
-                        self.__logger.log("[%s] %s (%s) is %s C" %(reading, self.__sensorReadings[reading]['loc'], self.__sensorReadings[reading]['locDetail'], self.__sensorReadings[reading]['tempReading']))
-                
-                # Wait for sensor refresh timing to do it again.
-                time.sleep(self.__tempSens.minPoll)
+        # Sweep in the background.
+        sweepThread = threading.Thread(target=self.__continuousSweeper)
+        sweepThread.daemon = True
+        sweepThread.start()
         
-        except KeyboardInterrupt:
-            # Flag to shut down.
-            self.__keepRunning = False
-            
-            # pass it up the stack.
-            raise KeyboardInterrupt
+        try:
+            # Watch in the foreground.
+            self.showReadingsCont()
         
-        except Exception as e:
-            # Flag to shut down.
+        finally:
+            # Stop sweeping when the view goes away, and wait so the sweeper doesn't outlive the interpreter.
             self.__keepRunning = False
-            
-            # Figure out what happened.
-            tb = traceback.format_exc()
-            
-            # Log it.
-            self.__logger.log("Exception in worker:\n%s" %tb)
-            
-            # Pass it up the stack
-            raise e
+            self.__stopEvent.set()
+            sweepThread.join()
     
     def run(self, mode='worker'):
         """
@@ -339,8 +996,14 @@ class thermalNetwork:
                 if self.__debugOn:
                     self.__logger.log("Entering dummy worker mode.")
                 
+                # Read from simulated sensors instead of the bus.
+                if self.__simSens == None:
+                    self.__simSens = ds18b20Sim()
+                
+                self.__tempSens = self.__simSens
+                
                 # Start the sensor worker.
-                self.__dummyWorker()
+                self.__worker()
                 
             except Exception as e:
                 # If we explode just fire the exception.
@@ -359,7 +1022,77 @@ class thermalNetwork:
                 raise e
         
         else:
-            raise RuntimeError("Unable to run thermalNetwork in %s mode. Valid modes are 'worker' and 'continuous'." %mode)
+            raise RuntimeError("Unable to run thermalNetwork in %s mode. Valid modes are 'worker', 'dummy', and 'continuous'." %mode)
+
+    def __supervisor(self, mode):
+        """
+        Run the engine in the given mode, restarting it with exponential backoff if it crashes.
+        """
+        
+        # Current restart delay.
+        restartDelay = self.__restartDelay
+        
+        while not self.__stopEvent.is_set():
+            # Note when this run started so a long healthy run resets the backoff.
+            startTime = time.time()
+            
+            # The workers clear this when they die so set it for each run.
+            self.__keepRunning = True
+            
+            try:
+                self.run(mode)
+            
+            except Exception:
+                tb = traceback.format_exc()
+                self.__logger.log("thermalNetwork engine crashed, restarting in %s sec:\n%s" %(restartDelay, tb))
+            
+            # We're done if we were asked to stop.
+            if self.__stopEvent.is_set():
+                break
+            
+            # Reset the backoff if the engine ran for a while before dying.
+            if (time.time() - startTime) > self.__maxRestartDelay:
+                restartDelay = self.__restartDelay
+            
+            # Wait before restarting, but wake up if we're told to stop.
+            self.__stopEvent.wait(restartDelay)
+            
+            # Back off.
+            restartDelay = min(restartDelay * 2, self.__maxRestartDelay)
+        
+        if self.__debugOn:
+            self.__logger.log("thermalNetwork supervisor exiting.")
+    
+    def start(self, mode='worker'):
+        """
+        Start the engine in the given mode as a supervised background thread that is restarted if it crashes. Returns immediately.
+        """
+        
+        # Clear any previous stop request.
+        self.__stopEvent.clear()
+        
+        self.__runThread = threading.Thread(target=self.__supervisor, args=(mode,))
+        self.__runThread.daemon = True
+        self.__runThread.start()
+    
+    def stop(self, timeout=10.0):
+        """
+        Stop the supervised engine started by start() and wait up to timeout seconds for it to exit.
+        """
+        
+        # Flag everything to shut down.
+        self.__stopEvent.set()
+        self.__keepRunning = False
+        
+        # Wake up anything waiting for a sweep.
+        self.__wakeSweepWaiters(False)
+        
+        # Wait for the supervisor to finish.
+        if self.__runThread != None:
+            self.__runThread.join(timeout)
+            
+            if self.__runThread.is_alive():
+                self.__logger.log("thermalNetwork engine didn't stop within %s sec." %timeout)
 
 
 # If we're being independently executed...
@@ -368,8 +1101,8 @@ if __name__ == '__main__':
     # Do a late import
     from sensLog import sensLog
     
-    # Logger
-    logger = sensLog()
+    # Log to syslog so we don't draw over the live view.
+    logger = sensLog('syslog')
     
     # Create minder instance
     thermalNet = thermalNetwork(logger)
@@ -399,21 +1132,21 @@ if __name__ == '__main__':
         thermalNet.registerSensor('28-03146444d4ff', 'basement restroom', 'south wall', ds18b20Meta)
     
     except KeyboardInterrupt:
-        self.__logger.log('Got keyboard interrupt. Quitting.')
+        logger.log('Got keyboard interrupt. Quitting.')
     
     except:
         tb = traceback.format_exc()
-        self.__logger.log("Exception registering snesors:\n%s" %tb)
+        logger.log("Exception registering snesors:\n%s" %tb)
     
     try:
         # Start monitoring.
         thermalNet.run('continuous')
     
     except KeyboardInterrupt:
-        self.__logger.log('Got keyboard interrupt. Quitting.')
+        logger.log('Got keyboard interrupt. Quitting.')
     
     except:
         tb = traceback.format_exc()
-        self.__logger.log("Unhandled exception thrown by runner:\n%s" %tb)
+        logger.log("Unhandled exception thrown by runner:\n%s" %tb)
     
-    self.__logger.log("Done monitoring sensor network.")
+    logger.log("Done monitoring sensor network.")